@@ -1,18 +1,74 @@
 from __future__ import annotations
+from array import array
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Any, Tuple, Callable
+import bisect
+import io
+import json
+import os
+import re
 import string
+import sys
 from nltk.stem import PorterStemmer
 
 stemmer = PorterStemmer()
 
+_TOKEN_RE = re.compile(r"\S+")
+
+@lru_cache(maxsize=1024)
+def _overlap_re(pattern: str) -> re.Pattern:
+    # Lookahead so the engine reports every overlapping occurrence.
+    return re.compile("(?=" + re.escape(pattern) + ")")
+
+_DELETE_TABLE = str.maketrans("", "", "',.")
+
+STEM_CACHE_FILENAME = "stem_cache.json"
+
+# token -> stem memo. A plain dict instead of lru_cache so the contents
+# can be persisted: the Porter stemmer is the indexing hotspot, and the
+# corpus vocabulary is identical between runs.
+_stem_cache: Dict[str, str] = {}
+
+def _stem_cache_path() -> str:
+    return os.path.join(os.path.dirname(__file__), STEM_CACHE_FILENAME)
+
+def load_stem_cache() -> None:
+    """Pre-populate the stem cache from disk, if a previous run saved one.
+
+    A missing or corrupt cache file is not an error — stemming just
+    starts from a cold cache.
+    """
+    try:
+        with open(_stem_cache_path(), "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, json.JSONDecodeError):
+        return
+
+    if isinstance(cached, dict):
+        _stem_cache.update(cached)
+
+def save_stem_cache() -> None:
+    try:
+        with open(_stem_cache_path(), "w", encoding="utf-8") as cache_file:
+            json.dump(_stem_cache, cache_file)
+    except OSError:
+        print(f"Writing {STEM_CACHE_FILENAME} failed.")
+
+def _cached_stem(token: str) -> str:
+    stem = _stem_cache.get(token)
+    if stem is None:
+        stem = _stem_cache[token] = stemmer.stem(token)
+    return stem
+
+@lru_cache(maxsize=50000)
 def normalize_token(token:str)->str:
-    token = token.lower()
-    token = token.replace("'", "").replace(",", "").replace(".", "")
-    return token
+    return token.lower().translate(_DELETE_TABLE)
 
 def normalized_stem_token(token:str)->str:
     normalized_token = normalize_token(token)
-    return stemmer.stem(normalized_token)
+    return _cached_stem(normalized_token)
 
 
 class Sonnet:
@@ -27,37 +83,42 @@ class Sonnet:
     def find_spans(text: str, pattern: str):
         """Return [(start, end), ...] for all (possibly overlapping) matches.
         Inputs should already be lowercased by the caller."""
-        spans = []
         if not pattern:
-            return spans
+            return []
 
-        for i in range(len(text) - len(pattern) + 1):
-            if text[i:i + len(pattern)] == pattern:
-                spans.append((i, i + len(pattern)))
-        return spans
+        n = len(pattern)
+        return [
+            (match.start(), match.start() + n)
+            for match in _overlap_re(pattern).finditer(text)
+        ]
 
     def search_for(self: Sonnet, query: str, index: Index) -> SearchResult:
         stem = normalized_stem_token(query)
 
-        if stem not in index.dictionary:
+        stem_postings = index.dictionary.get(stem)
+        if stem_postings is None:
             return SearchResult(self.title, [], [], 0)
 
-        postings = index.dictionary[stem].get(self.id, [])
+        postings = stem_postings.doc_rows(self.id)
+        if postings is None:
+            return SearchResult(self.title, [], [], 0)
 
         title_spans = []
         line_matches_dict = {}  # line_no -> spans
 
-        for posting in postings:
-            span = (posting.position, posting.position + len(posting.original_token))
+        for line_no, position, length in postings:
+            span = (position, position + length)
 
-            if posting.line_no is None:
+            if line_no < 0:
                 title_spans.append(span)
             else:
-                line_matches_dict.setdefault(posting.line_no, []).append(span)
+                line_matches_dict.setdefault(line_no, []).append(span)
 
+        # Postings arrive in line order, so the dict's insertion order is
+        # already sorted by line number.
         line_matches = [
             LineMatch(ln, self.lines[ln - 1], spans)
-            for ln, spans in sorted(line_matches_dict.items())
+            for ln, spans in line_matches_dict.items()
         ]
 
         total = len(title_spans) + sum(len(lm.spans) for lm in line_matches)
@@ -66,6 +127,8 @@ class Sonnet:
 
 
 class LineMatch:
+    __slots__ = ("line_no", "text", "spans")
+
     def __init__(self, line_no: int, text: str, spans: List[Tuple[int, int]]):
         self.line_no = line_no
         self.text = text
@@ -75,68 +138,253 @@ class LineMatch:
         return LineMatch(self.line_no, self.text, self.spans)
 
 
-class Posting:
-    def __init__(self, line_no: int, position: int, original_token: str):
-        self.line_no = line_no
-        self.position = position
-        self.original_token = original_token
+def _merge_sorted_spans(a: List[Tuple[int, int]], b: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge two already-sorted span lists into a new sorted list.
+
+    A linear two-pointer pass instead of concatenate-and-sort.
+    """
+    merged = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] <= b[j]:
+            merged.append(a[i])
+            i += 1
+        else:
+            merged.append(b[j])
+            j += 1
+    merged.extend(a[i:])
+    merged.extend(b[j:])
+    return merged
+
+
+def _merge_line_matches(a: List[LineMatch], b: List[LineMatch], in_place: bool) -> List[LineMatch]:
+    """Merge two line-match lists that are already sorted by line number.
+
+    Matches for the same line have their spans merged. With in_place=True
+    the input matches are reused (and mutated on collisions); otherwise
+    both sides are copied so the inputs stay untouched.
+    """
+    merged = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        lm_a, lm_b = a[i], b[j]
+        if lm_a.line_no < lm_b.line_no:
+            merged.append(lm_a if in_place else lm_a.copy())
+            i += 1
+        elif lm_b.line_no < lm_a.line_no:
+            merged.append(lm_b if in_place else lm_b.copy())
+            j += 1
+        else:
+            spans = _merge_sorted_spans(lm_a.spans, lm_b.spans)
+            if in_place:
+                lm_a.spans = spans
+                merged.append(lm_a)
+            else:
+                merged.append(LineMatch(lm_a.line_no, lm_a.text, spans))
+            i += 1
+            j += 1
+    merged.extend(a[i:] if in_place else (lm.copy() for lm in a[i:]))
+    merged.extend(b[j:] if in_place else (lm.copy() for lm in b[j:]))
+    return merged
+
+
+class PostingList:
+    """Postings stored as parallel arrays instead of one object per
+    occurrence.
+
+    A line number of -1 marks a posting from the sonnet's title.
+    """
+
+    __slots__ = ("line_nos", "positions", "lengths")
+
+    def __init__(self):
+        self.line_nos = array("i")
+        self.positions = array("i")
+        self.lengths = array("i")
+
+    def add(self, line_no: int | None, position: int, token: str):
+        self.line_nos.append(-1 if line_no is None else line_no)
+        self.positions.append(position)
+        # The span end is all consumers need; the token itself can always
+        # be recovered from the source text via text[pos:pos + length].
+        self.lengths.append(len(token))
+
+    def rows(self, lo: int, hi: int):
+        """Iterate the (line_no, position, length) triples in [lo, hi)."""
+        return zip(self.line_nos[lo:hi], self.positions[lo:hi], self.lengths[lo:hi])
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __iter__(self):
+        return zip(self.line_nos, self.positions, self.lengths)
 
     def __repr__(self) -> str:
-        return f"{self.line_no}:{self.position}"
+        return " ".join(f"{ln}:{pos}" for ln, pos, _ in self)
+
+
+class StemPostings:
+    """One flat postings table for a stem across all documents.
+
+    Tokens are added sonnet by sonnet, so each document owns a contiguous
+    [lo, hi) slice of the table, recorded in `offsets`. Looking up a
+    document is one dict hit plus a slice instead of walking nested
+    per-document containers.
+
+    `doc_ids` keeps the documents containing the stem as a compact int
+    array, sorted by construction since sonnets are indexed in id order.
+    Sorted arrays are what posting-list intersection wants to work on.
+    """
+
+    __slots__ = ("postings", "offsets", "doc_ids")
+
+    def __init__(self):
+        self.postings = PostingList()
+        self.offsets = {}  # doc_id -> (lo, hi)
+        self.doc_ids = array("i")
+
+    def add(self, doc_id: int, line_no: int | None, position: int, token: str):
+        lo = len(self.postings)
+        self.postings.add(line_no, position, token)
+        bounds = self.offsets.get(doc_id)
+        if bounds is None:
+            self.doc_ids.append(doc_id)
+        self.offsets[doc_id] = (lo if bounds is None else bounds[0], lo + 1)
+
+    def doc_rows(self, doc_id: int):
+        """Return the (line_no, position, length) triples for one document,
+        or None if the document does not contain this stem."""
+        bounds = self.offsets.get(doc_id)
+        if bounds is None:
+            return None
+        return self.postings.rows(*bounds)
+
+    def items(self):
+        """Yield (doc_id, rows) per document, in document-id order."""
+        for doc_id, (lo, hi) in self.offsets.items():
+            yield doc_id, self.postings.rows(lo, hi)
+
+
+# Below this corpus size the process startup and pickling overhead of
+# parallel indexing outweighs the tokenize/stem work, so stay serial.
+_PARALLEL_MIN_SONNETS = 1000
+
+def _index_one(sonnet: Sonnet) -> Tuple[int, List[Tuple[str, int | None, int, str]]]:
+    """Tokenize and stem a single sonnet into plain posting tuples.
+
+    Kept at module level so ProcessPoolExecutor can pickle it; the plain
+    tuples keep the per-sonnet partial results cheap to ship between
+    processes. Returns (doc_id, [(stem, line_no, position, token), ...]).
+    """
+    entries = []
+    # This loop touches every token of the sonnet, so bind the helpers to
+    # locals once: the interpreter then skips the global and attribute
+    # lookups that would otherwise run per token.
+    append = entries.append
+    tokenize = Index.tokenize
+    stem_token = normalized_stem_token
+
+    # Lowercase whole lines up front: one O(chars) pass per line instead
+    # of one lower() per token, and repeated tokens hit the normalize
+    # cache regardless of their original casing. Token positions and
+    # lengths are unaffected, and display always uses the original text.
+    for token, pos in tokenize(sonnet.title.lower()):
+        stem = stem_token(token)
+        if stem:
+            append((stem, None, pos, token))
+
+    for line_no, line in enumerate(sonnet.lines, start=1):
+        for token, pos in tokenize(line.lower()):
+            stem = stem_token(token)
+            if stem:
+                append((stem, line_no, pos, token))
+
+    return sonnet.id, entries
 
 
 class Index:
     def __init__(self, sonnets: list[Sonnet]):
         self.sonnets = {sonnet.id: sonnet for sonnet in sonnets}
-        self.dictionary = {}
-
-        for sonnet in sonnets:
-            for token, pos in self.tokenize(sonnet.title):
-                stem = normalized_stem_token(token)
-                if stem:
-                    self._add_token(sonnet.id, stem, None, pos, token)
-
-            for line_no, line in enumerate(sonnet.lines, start=1):
-                for token, pos in self.tokenize(line):
-                    stem = normalized_stem_token(token)
-                    if stem:
-                        self._add_token(sonnet.id, stem, line_no, pos, token)
+        self.dictionary = defaultdict(StemPostings)
+
+        # Warm the stem cache from the previous run — with an unchanged
+        # corpus the expensive Porter stemming is skipped entirely.
+        load_stem_cache()
+        known_stems = len(_stem_cache)
+
+        # Sonnets are independent during tokenization and stemming, so a
+        # large corpus is indexed across processes; only the merge below
+        # has to run serially. Small corpora stay in-process.
+        if len(sonnets) >= _PARALLEL_MIN_SONNETS:
+            with ProcessPoolExecutor() as executor:
+                partials = list(executor.map(_index_one, sonnets, chunksize=16))
+
+            # The workers stemmed into their own processes' caches, so
+            # replay their results into ours — otherwise a parallel build
+            # would never warm or persist the stem cache.
+            for _, entries in partials:
+                for stem, _, _, token in entries:
+                    _stem_cache[normalize_token(token)] = stem
+        else:
+            partials = map(_index_one, sonnets)
+
+        # Merge in document order so each document keeps one contiguous
+        # slice per stem.
+        add_token = self._add_token
+        for doc_id, entries in partials:
+            for stem, line_no, pos, token in entries:
+                add_token(doc_id, stem, line_no, pos, token)
                 # ToDo 2: Implement logic of adding tokens to the index. Use the pre-defined methods tokenize and
             #  _add_token to do so. Index the title and the lines of the sonnet.
 
+        # The dictionary is complete at this point; keep a sorted view of
+        # the vocabulary so prefix lookups can binary-search it.
+        self._sorted_stems = sorted(self.dictionary)
+
+        if len(_stem_cache) > known_stems:
+            save_stem_cache()
+
     @staticmethod
     def tokenize(text):
         """
          Split a text string into whitespace-separated tokens.
 
-         Each token is returned together with its starting character
-         position in the input string.
+         Each token is yielded together with its starting character
+         position in the input string, so no intermediate token list is
+         materialized.
 
          Args:
              text: The input text to tokenize.
 
-         Returns:
-             A list of (token, position) tuples, where:
+         Yields:
+             (token, position) tuples, where:
              - token is a non-whitespace substring of `text`
              - position is the 0-based start index of the token in `text`
          """
-        import re
-        tokens = [
-            (match.group(), match.start())
-            for match in re.finditer(r"\S+", text)
-        ]
-
-        return tokens
+        for match in _TOKEN_RE.finditer(text):
+            yield match.group(), match.start()
 
-    def _add_token(self, doc_id: int, stem: str, line_no: int | None, position: int, token: str):
-        if stem not in self.dictionary:
-            self.dictionary[stem] = {}
+    def prefix_lookup(self, prefix: str) -> List[str]:
+        """
+        Return all stems in the vocabulary starting with `prefix`.
 
-        postings = self.dictionary[stem]
-        if doc_id not in postings:
-            postings[doc_id] = []
+        Binary-searches the sorted stem list, so the cost is
+        O(log |V| + k) for k matching stems rather than a scan of the
+        whole dictionary.
+        """
+        stems = []
+        start = bisect.bisect_left(self._sorted_stems, prefix)
+        for i in range(start, len(self._sorted_stems)):
+            stem = self._sorted_stems[i]
+            if not stem.startswith(prefix):
+                break
+            stems.append(stem)
+        return stems
 
-        postings[doc_id].append(Posting(line_no, position, token))
+    def _add_token(self, doc_id: int, stem: str, line_no: int | None, position: int, token: str):
+        # Interned stems share one string object per distinct stem, so the
+        # dict key hash and comparison reduce to pointer checks.
+        self.dictionary[sys.intern(stem)].add(doc_id, line_no, position, token)
 
     def search_for(self, token: str) -> dict[int, SearchResult]:
         token = normalized_stem_token(token)
@@ -146,27 +394,26 @@ class Index:
             return results
 
         if token in self.dictionary:
-            postings_list = self.dictionary[token]
-            for doc_id, postings in postings_list.items():
+            stem_postings = self.dictionary[token]
+            for doc_id, postings in stem_postings.items():
                 sonnet = self.sonnets[doc_id]
 
                         # ToDo 3: Based on the posting create the corresponding SearchResult instance
-                for posting in postings:
+                for line_no, position, length in postings:
                     # Build SearchResult for each posting
-                    if posting.line_no is None:
+                    span = (position, position + length)
+                    if line_no < 0:
                         # title highlight
-                        span = (posting.position, posting.position + len(posting.original_token))
                         sr = SearchResult(sonnet.title, [span], [], 1)
                     else:
-                        line_text = sonnet.lines[posting.line_no - 1]
-                        span = (posting.position, posting.position + len(posting.original_token))
-                        lm = LineMatch(posting.line_no, line_text, [span])
+                        line_text = sonnet.lines[line_no - 1]
+                        lm = LineMatch(line_no, line_text, [span])
                         sr = SearchResult(sonnet.title, [], [lm], 1)
 
                     if doc_id not in results:
                         results[doc_id] = sr
                     else:
-                        results[doc_id] = results[doc_id].combine_with(sr)
+                        results[doc_id]._combine_inplace(sr)
 
         return results
 
@@ -175,12 +422,41 @@ class Searcher:
         self.index = Index(sonnets)
         self.total_sonnets = len(sonnets)
 
+        # Interactive sessions repeat queries, so completed searches are
+        # cached per (query, search_mode). The index never changes after
+        # construction, so entries never go stale.
+        self._query_cache: Dict[Tuple[str, str], List[SearchResult]] = {}
 
     def search(self, query: str, search_mode: str) -> List[SearchResult]:
+        cache_key = (query, search_mode)
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            # Hand out a copy so callers mutating the returned list cannot
+            # corrupt the cached entry.
+            return list(cached)
 
         words = query.split()
 
+        if search_mode == "AND" and len(words) > 1:
+            def document_frequency(word: str) -> int:
+                stem_postings = self.index.dictionary.get(normalized_stem_token(word))
+                return len(stem_postings.doc_ids) if stem_postings else 0
+
+            frequencies = {word: document_frequency(word) for word in words}
+
+            # A term matching no sonnet empties the whole conjunction, so
+            # short-circuit before doing any merge work.
+            if not all(frequencies.values()):
+                self._query_cache[cache_key] = []
+                return []
+
+            # AND is commutative, so start with the rarest term: the
+            # intermediate result set can only shrink from there, which
+            # minimizes the merge work for the remaining words.
+            words = sorted(words, key=frequencies.__getitem__)
+
         combined_results = {}
+        first_word = True
 
         for word in words:
             # Searching for the word in all sonnets
@@ -196,33 +472,43 @@ class Searcher:
             #         mode will always contains all search results.
 
             # Add your code here...
-            if not combined_results:
+            if first_word:
                 combined_results = results.copy()
+                first_word = False
                 continue
 
             if search_mode == "OR":
                 for doc_id, r in results.items():
                     if doc_id in combined_results:
-                        combined_results[doc_id] = combined_results[doc_id].combine_with(r)
+                        combined_results[doc_id]._combine_inplace(r)
                     else:
                         combined_results[doc_id] = r
             else:
-                deleted = []
-                for doc_id in combined_results:
-                    if doc_id in results:
-                        combined_results[doc_id] = combined_results[doc_id].combine_with(results[doc_id])
-                    else:
-                        deleted.append(doc_id)
-                for d in deleted:
-                    del combined_results[d]
+                # AND: only sonnets present on both sides survive, so merge
+                # just the key intersection in one pass.
+                combined_results = {
+                    doc_id: combined_results[doc_id]._combine_inplace(results[doc_id])
+                    for doc_id in combined_results.keys() & results.keys()
+                }
+
+                # An empty intersection can never grow back in AND mode.
+                if not combined_results:
+                    break
             # At this point combined_results contains a dictionary with the sonnet ID as key and the search result for
             # this sonnet. Just like the result you receive from the index, but combined for all words
 
-        results = list(combined_results.values())
-        return sorted(results, key=lambda sr: sr.title)
+        results = sorted(combined_results.values(), key=lambda sr: sr.title)
+
+        if len(self._query_cache) >= 1024:
+            self._query_cache.clear()
+        self._query_cache[cache_key] = list(results)
+
+        return results
 
 
 class SearchResult:
+    __slots__ = ("title", "title_spans", "line_matches", "matches")
+
     def __init__(self, title: str, title_spans: List[Tuple[int, int]], line_matches: List[LineMatch],
                  matches: int) -> None:
         self.title = title
@@ -235,36 +521,37 @@ class SearchResult:
 
     @staticmethod
     def ansi_highlight(text: str, spans, highlight_mode) -> str:
-        """Return text with ANSI highlight escape codes inserted."""
+        """Return text with ANSI highlight escape codes inserted.
+
+        `spans` must be sorted by start position — all producers maintain
+        that invariant. Overlapping spans are merged on the fly during the
+        single output pass.
+        """
         if not spans:
             return text
 
-        spans = sorted(spans)
-        merged = []
+        ansi_sequence = "\033[43m\033[30m" if highlight_mode == "DEFAULT" else "\033[1;92m"
 
-        # Merge overlapping spans
+        out = io.StringIO()
+        i = 0
         current_start, current_end = spans[0]
         for s, e in spans[1:]:
             if s <= current_end:
                 current_end = max(current_end, e)
-            else:
-                merged.append((current_start, current_end))
-                current_start, current_end = s, e
-        merged.append((current_start, current_end))
-
-        ansi_sequence = "\033[43m\033[30m" if highlight_mode == "DEFAULT" else "\033[1;92m"
-
-        # Build highlighted string
-        out = []
-        i = 0
-        for s, e in merged:
-            out.append(text[i:s])
-            out.append(ansi_sequence)  # yellow background, black text
-            out.append(text[s:e])
-            out.append("\033[0m")  # reset
-            i = e
-        out.append(text[i:])
-        return "".join(out)
+                continue
+            out.write(text[i:current_start])
+            out.write(ansi_sequence)  # yellow background, black text
+            out.write(text[current_start:current_end])
+            out.write("\033[0m")  # reset
+            i = current_end
+            current_start, current_end = s, e
+
+        out.write(text[i:current_start])
+        out.write(ansi_sequence)
+        out.write(text[current_start:current_end])
+        out.write("\033[0m")
+        out.write(text[current_end:])
+        return out.getvalue()
 
     def print(self, idx, highlight_mode: str | None, total_docs):
         title_line = (
@@ -281,24 +568,30 @@ class SearchResult:
             )
             print(f"  [{lm.line_no:2}] {line_out}")
 
+    def _combine_inplace(self: SearchResult, other: SearchResult) -> SearchResult:
+        """Fold `other` into this result and return self.
+
+        Mutating variant of combine_with for internal accumulation, where
+        the receiver is a freshly built result nobody else holds on to.
+        """
+        self.matches += other.matches
+        if other.title_spans:
+            self.title_spans = _merge_sorted_spans(self.title_spans, other.title_spans)
+
+        if other.line_matches:
+            self.line_matches = _merge_line_matches(self.line_matches, other.line_matches, in_place=True)
+
+        return self
+
     def combine_with(self: SearchResult, other: SearchResult) -> SearchResult:
         """Combine two search results."""
 
         combined = self.copy()  # shallow copy
 
         combined.matches = self.matches + other.matches
-        combined.title_spans = sorted(self.title_spans + other.title_spans)
+        combined.title_spans = _merge_sorted_spans(self.title_spans, other.title_spans)
 
         # Merge line_matches by line number
-        lines_by_no = {lm.line_no: lm.copy() for lm in self.line_matches}
-        for lm in other.line_matches:
-            ln = lm.line_no
-            if ln in lines_by_no:
-                # extend spans & keep original text
-                lines_by_no[ln].spans.extend(lm.spans)
-            else:
-                lines_by_no[ln] = lm.copy()
-
-        combined.line_matches = sorted(lines_by_no.values(), key=lambda lm: lm.line_no)
+        combined.line_matches = _merge_line_matches(self.line_matches, other.line_matches, in_place=False)
 
         return combined